@@ -1,96 +1,212 @@
 import requests
 import logging
 import os
+import threading
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Webhook host fragment -> platform, checked in order
+PLATFORM_HOSTS = (
+    ('slack.com', 'slack'),
+    ('discord.com', 'discord'),
+    ('chat.googleapis.com', 'google_chat'),
+)
+
+# Payload key carrying the message text for each platform
+PAYLOAD_KEYS = {
+    'slack': 'text',
+    'discord': 'content',
+    'google_chat': 'text',
+}
+
+# Per-message size caps, kept slightly below each platform's hard limit
+MESSAGE_LIMITS = {
+    'slack': 39000,
+    'discord': 1900,
+    'google_chat': 3900,
+}
 
 class ChatAPI:
-    def __init__(self, webhook_url=None):
-        """Initialize the Chat API client."""
+    def __init__(self, webhook_url=None, session=None):
+        """Initialize the Chat API client, optionally sharing another client's HTTP session."""
         self.webhook_url = webhook_url or os.getenv('CHAT_WEBHOOK_URL')
         if not self.webhook_url:
             raise ValueError("CHAT_WEBHOOK_URL is required")
         
         # Determine platform from webhook URL
         self.platform = self._detect_platform()
+        self._payload_key = PAYLOAD_KEYS.get(self.platform, 'text')
+
+        # Reuse keep-alive connections to the webhook host across sends (and across
+        # clients that share a session, e.g. two Google Chat spaces)
+        self._owns_session = session is None
+        self.session = session or self.create_session()
+
+        # Meetings queued within FLUSH_DELAY seconds of each other go out in one post
+        self.FLUSH_DELAY = 2.0
+        self._pending = []
+        self._flush_lock = threading.Lock()
+        self._flush_timer = None
         logging.info(f"ChatAPI initialized successfully for {self.platform}")
 
+    @staticmethod
+    def create_session():
+        """Create a pooled HTTP session with retries for webhook posts."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=10,
+            # POST is not retried by default; 429/5xx replies usually mean the message was not
+            # delivered, so a rare duplicate post is accepted. Read errors are not retried
+            # since the webhook may already have posted the message.
+            max_retries=Retry(
+                total=3,
+                read=0,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset({'POST'}),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        )
+        session.mount('https://', adapter)
+        return session
+
     def _detect_platform(self):
         """Detect chat platform from webhook URL."""
         url = self.webhook_url.lower()
-        if 'slack.com' in url:
-            return 'slack'
-        elif 'discord.com' in url:
-            return 'discord'
-        elif 'chat.googleapis.com' in url:
-            return 'google_chat'
-        else:
-            return 'unknown'
+        for host, platform in PLATFORM_HOSTS:
+            if host in url:
+                return platform
+        return 'unknown'
 
     def _format_message(self, message, platform=None):
         """Format message according to platform requirements."""
-        platform = platform or self.platform
-        
-        if platform == 'slack':
-            return {'text': message}
-        elif platform == 'discord':
-            return {'content': message}
-        elif platform == 'google_chat':
-            return {'text': message}
-        else:
+        if platform:
             # Default to plain text
-            return {'text': message}
+            return {PAYLOAD_KEYS.get(platform, 'text'): message}
+        return {self._payload_key: message}
 
     def send_daily_meeting_summary(self, meetings):
+        """Queue meetings for the next combined summary post to the chat channel."""
+        with self._flush_lock:
+            queued = {(meeting.get('name'), meeting.get('summary')) for meeting in self._pending}
+            for meeting in meetings:
+                key = (meeting.get('name'), meeting.get('summary'))
+                if not meeting.get('summary') or key in queued:
+                    logging.info(f"Skipping empty or duplicate summary for {meeting.get('name', 'Untitled Meeting')}")
+                    continue
+                queued.add(key)
+                self._pending.append(meeting)
+            if not self._pending:
+                return True
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+        return True
+
+    def flush(self):
+        """Send all queued meetings now as one summary."""
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            meetings, self._pending = self._pending, []
+        if not meetings:
+            return True
+        return self._send_meeting_summary(meetings)
+
+    def _send_meeting_summary(self, meetings):
         """Send a summary of today's meetings to the chat channel."""
         try:
             if not meetings:
                 logging.info("No daily meetings to report")
                 return True
 
-            # Create the message
+            # Create the message, one block per meeting
             today = datetime.now().strftime("%Y-%m-%d")
-            message = f"*Meeting Summary for {today}*\n\n"
-            
+            blocks = []
             for meeting in meetings:
-                # Extract meeting details
                 title = meeting.get('name', 'Untitled Meeting')
                 summary = meeting.get('summary', 'No summary available')
-                
-                # Add to message
-                message += f"📝 *{title}*\n"
-                message += f"{summary}\n\n"
+                blocks.append(f"📝 *{title}*\n{summary}\n")
+            # The header travels with the first meeting so it is never posted on its own
+            blocks[0] = f"*Meeting Summary for {today}*\n\n{blocks[0]}"
 
-            # Format message for platform
-            payload = self._format_message(message)
-            
-            # Send to chat platform
-            response = requests.post(
-                self.webhook_url,
-                json=payload
-            )
-            
-            if response.status_code == 200:
-                logging.info(f"Successfully sent meeting summary to {self.platform}")
-                return True
-            else:
-                logging.error(f"Failed to send message to {self.platform}. Status code: {response.status_code}, response: {response.text}")
-                return False
+            # Send to chat platform, split to stay under the platform's size cap
+            messages = self._split_message(blocks, MESSAGE_LIMITS.get(self.platform, 3900))
+            sent_all = True
+            for message in messages:
+                response = self.session.post(
+                    self.webhook_url,
+                    json=self._format_message(message),
+                    timeout=(3.05, 10)
+                )
+                if response.status_code != 200:
+                    logging.error(f"Failed to send message to {self.platform}. Status code: {response.status_code}, response: {response.text}")
+                    sent_all = False
+
+            if sent_all:
+                logging.info(f"Successfully sent meeting summary to {self.platform} in {len(messages)} message(s)")
+            return sent_all
                 
         except Exception as e:
             logging.error(f"Failed to send chat message: {str(e)}")
             return False
 
+    def _split_message(self, blocks, limit):
+        """Join message blocks with blank lines into as few messages of at most limit characters as possible."""
+        messages = []
+        current = []
+        current_size = 0
+        for block in blocks:
+            while block:
+                room = limit - current_size - (1 if current else 0)
+                if len(block) <= room:
+                    current.append(block)
+                    current_size += len(block) + (1 if len(current) > 1 else 0)
+                    break
+                # Start a fresh message if the block fits there or nothing fits here
+                if current and (len(block) <= limit or room <= 0):
+                    messages.append('\n'.join(current))
+                    current = []
+                    current_size = 0
+                    continue
+                # Fill the remaining space, preferring a line boundary unless it would leave most of it empty
+                cut = block.rfind('\n', 0, room + 1)
+                if cut > room // 2:
+                    piece, block = block[:cut], block[cut + 1:]
+                else:
+                    piece, block = block[:room], block[room:]
+                current.append(piece)
+                messages.append('\n'.join(current))
+                current = []
+                current_size = 0
+        if current:
+            messages.append('\n'.join(current))
+        return messages
+
     def send_message(self, message):
         """Send a message to the chat channel."""
         try:
             payload = self._format_message(message)
-            response = requests.post(
+            response = self.session.post(
                 self.webhook_url,
-                json=payload
+                json=payload,
+                timeout=(3.05, 10)
             )
             response.raise_for_status()
             logging.info(f"Message sent successfully to {self.platform}")
             return True
         except Exception as e:
             logging.error(f"Failed to send message: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+
+    def close(self):
+        """Send queued meetings, then close the underlying HTTP session if this client created it."""
+        self.flush()
+        if self._owns_session:
+            self.session.close()
@@ -1,13 +1,29 @@
 import google.auth
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, HttpRequest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 import logging
 import os
 import json
+import random
 import requests
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from datetime import datetime, timedelta
 
+logger = logging.getLogger('drive')
+
+# Query for Google Docs with a given (escaped) title
+TITLE_QUERY_TEMPLATE = "name = '{}' and mimeType = 'application/vnd.google-apps.document' and trashed = false"
+
+def _escape_drive_query_literal(text):
+    """Escape a string for use inside a single-quoted Drive query literal."""
+    return text.replace('\\', '\\\\').replace("'", "\\'")
+
 class DriveAPI:
     def __init__(self, folder_mapping=None, users_to_process=None):
         """Initialize the Drive API client using Application Default Credentials."""
@@ -17,109 +33,377 @@ class DriveAPI:
         ]
         # Customize this property name if needed
         self.PROCESSED_PROPERTY = 'meeting_processed'
+        # Google caps batch requests at 100 calls, but large batches are prone to 500s
+        self.BATCH_SIZE = 50
+        # Parallel folder listings; keep well below Drive's per-user QPS quota
+        self.MAX_WORKERS = 8
+        # Meet Recordings folders rarely change, so discovery results are reused for a while
+        self.FOLDER_CACHE_TTL = 300
+        self._folders_cache = {}  # owner email (None for all owners) -> (timestamp, folders)
+        self._folder_access = {}  # folder ID -> (timestamp, accessible)
         try:
             credentials, project = google.auth.default(scopes=self.SCOPES)
             self.project_id = project
             self.credentials = credentials
-            self.service = build('drive', 'v3', credentials=self.credentials, requestBuilder=HttpRequest)
-            self.docs_service = build('docs', 'v1', credentials=self.credentials, requestBuilder=HttpRequest)
+            # httplib2 is not thread-safe, so every thread gets its own API clients
+            self._thread_local = threading.local()
+            self._build_services()
+            # Long-lived workers keep their per-thread clients and connections across calls
+            self._executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS, thread_name_prefix='drive')
+            self._setup_processed_db(os.getenv('PROCESSED_DB_PATH', 'processed.db'))
+            # Files currently being processed by this process, across overlapping requests
+            self._in_progress = set()
+            self._in_progress_lock = threading.Lock()
+            # Serializes reading, listing and advancing the changes page token
+            self._changes_lock = threading.Lock()
             self.folder_mapping = folder_mapping or {}
-            self.users_to_process = users_to_process or []
-            logging.info("DriveAPI initialized successfully with service account credentials.")
+            self.users_to_process = [user.strip() for user in users_to_process or [] if user.strip()]
+            logger.info("DriveAPI initialized successfully with service account credentials.")
         except Exception as e:
-            logging.error(f"Failed to initialize DriveAPI: {str(e)}")
+            logger.error(f"Failed to initialize DriveAPI: {str(e)}")
             raise
 
+    def _build_services(self):
+        """Build the Drive and Docs clients for the current thread."""
+        # Use the discovery documents bundled with google-api-python-client instead of fetching them
+        self._thread_local.service = build('drive', 'v3', credentials=self.credentials,
+                                           static_discovery=True, cache_discovery=False)
+        self._thread_local.docs_service = build('docs', 'v1', credentials=self.credentials,
+                                                static_discovery=True, cache_discovery=False)
+
+    @property
+    def service(self):
+        """Drive API client bound to the current thread."""
+        if not hasattr(self._thread_local, 'service'):
+            self._build_services()
+        return self._thread_local.service
+
+    @property
+    def docs_service(self):
+        """Docs API client bound to the current thread."""
+        if not hasattr(self._thread_local, 'docs_service'):
+            self._build_services()
+        return self._thread_local.docs_service
+
+    def _setup_processed_db(self, path):
+        """Open the local index of processed files; Drive properties stay the shared source of truth."""
+        self._db_lock = threading.Lock()
+        self.processed_db = sqlite3.connect(path, check_same_thread=False)
+        self.processed_db.execute('PRAGMA journal_mode=WAL')
+        self.processed_db.execute('PRAGMA synchronous=NORMAL')
+        self.processed_db.execute('CREATE TABLE IF NOT EXISTS processed (file_id TEXT PRIMARY KEY, marked_at INTEGER)')
+        # Small key/value store for the push notification channel and changes page token
+        self.processed_db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+        self.processed_db.commit()
+
+    def _get_state(self, key):
+        """Read a JSON value from the local state table."""
+        with self._db_lock:
+            row = self.processed_db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_state(self, key, value):
+        """Write a JSON value to the local state table."""
+        with self._db_lock:
+            self.processed_db.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                (key, json.dumps(value))
+            )
+            self.processed_db.commit()
+
+    def _get_locally_processed(self, file_ids):
+        """Return the subset of file IDs recorded as processed in the local index."""
+        file_ids = list(file_ids)
+        found = set()
+        with self._db_lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(file_ids), 500):
+                chunk = file_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.processed_db.execute(
+                    f"SELECT file_id FROM processed WHERE file_id IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def _record_processed(self, file_ids):
+        """Record file IDs as processed in the local index."""
+        now = int(time.time())
+        with self._db_lock:
+            self.processed_db.executemany(
+                "INSERT OR REPLACE INTO processed (file_id, marked_at) VALUES (?, ?)",
+                [(file_id, now) for file_id in file_ids]
+            )
+            self.processed_db.commit()
+
+    def claim_file(self, file_id):
+        """Start working on a file, returning False if it is in progress or already processed locally."""
+        with self._in_progress_lock:
+            if file_id in self._in_progress or self._get_locally_processed([file_id]):
+                return False
+            self._in_progress.add(file_id)
+            return True
+
+    def release_file(self, file_id):
+        """Finish working on a file claimed with claim_file."""
+        with self._in_progress_lock:
+            self._in_progress.discard(file_id)
+
+    def record_processed_locally(self, file_id):
+        """Record a file as processed in the local index only, e.g. before editing it."""
+        self._record_processed([file_id])
+
+    def forget_processed_locally(self, file_id):
+        """Undo record_processed_locally, so the file is picked up again."""
+        with self._db_lock:
+            self.processed_db.execute("DELETE FROM processed WHERE file_id = ?", (file_id,))
+            self.processed_db.commit()
+
+    def close(self):
+        """Shut down the worker pool and the local processed index."""
+        self._executor.shutdown(wait=True)
+        with self._db_lock:
+            self.processed_db.close()
+
     def get_new_meet_files(self, user_email):
-        """Get all unprocessed Meet transcripts from all Meet Recordings folders."""
+        """Get all unprocessed Meet transcripts from the Meet Recordings folders owned by user_email."""
         try:
-            logging.info("Starting search for unprocessed Google Docs files only (excluding video recordings)")
-            folder_query = (
-                "name = 'Meet Recordings' "
-                "and mimeType = 'application/vnd.google-apps.folder' "
-                "and trashed = false"
-            )
-            logging.info(f"Searching for Meet Recordings folders with query: {folder_query}")
-            folder_response = self.service.files().list(
-                q=folder_query,
-                spaces='drive',
-                fields='files(id, name, owners)',
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True,
-                corpora='allDrives'
-            ).execute()
-            if not folder_response.get('files'):
-                logging.error(f"No Meet Recordings folders found. Response: {folder_response}")
+            logger.info("Starting search for unprocessed Google Docs files only (excluding video recordings)")
+            folders = self._find_meet_folders(user_email)
+            if not folders:
                 return []
-            folders = folder_response['files']
-            logging.info(f"Found {len(folders)} Meet Recordings folders")
-            for folder in folders:
-                logging.info(f"Found folder '{folder['name']}' with ID: {folder['id']}")
-                if 'owners' in folder:
-                    owner_emails = [owner.get('emailAddress', 'unknown') for owner in folder['owners']]
-                    logging.info(f"Folder owners: {', '.join(owner_emails)}")
             all_files = []
-            for folder in folders:
+            for files in self._executor.map(self._list_folder, folders):
+                all_files.extend(files)
+            logger.info(f"Total Google Docs files found across all accessible folders: {len(all_files)}")
+            return all_files
+        except Exception as e:
+            logger.error(f"Failed to fetch Meet transcripts: {e}")
+            return []
+
+    def _find_meet_folders(self, user_email=None):
+        """Find the Meet Recordings folders owned by user_email (or by anyone when None), cached for FOLDER_CACHE_TTL seconds."""
+        cached = self._folders_cache.get(user_email)
+        if cached is not None and time.time() - cached[0] < self.FOLDER_CACHE_TTL:
+            logger.info(f"Using {len(cached[1])} cached Meet Recordings folders for {user_email or 'all users'}")
+            return cached[1]
+        folder_query = (
+            "name = 'Meet Recordings' "
+            "and mimeType = 'application/vnd.google-apps.folder' "
+            "and trashed = false"
+        )
+        if user_email:
+            # Only the user's own folders, which live in their My Drive and are shared with us
+            folder_query += f" and '{_escape_drive_query_literal(user_email)}' in owners"
+            search_scope = {'corpora': 'user'}
+        else:
+            search_scope = {'corpora': 'allDrives', 'includeItemsFromAllDrives': True}
+        logger.info(f"Searching for Meet Recordings folders with query: {folder_query}")
+        folder_response = self._execute(self.service.files().list(
+            q=folder_query,
+            spaces='drive',
+            fields='files(id, name, owners)',
+            supportsAllDrives=True,
+            **search_scope
+        ))
+        if not folder_response.get('files'):
+            logger.error(f"No Meet Recordings folders found. Response: {folder_response}")
+            return []
+        folders = folder_response['files']
+        logger.info(f"Found {len(folders)} Meet Recordings folders")
+        for folder in folders:
+            logger.info(f"Found folder '{folder['name']}' with ID: {folder['id']}")
+            if 'owners' in folder:
+                owner_emails = [owner.get('emailAddress', 'unknown') for owner in folder['owners']]
+                logger.info(f"Folder owners: {', '.join(owner_emails)}")
+        self._folders_cache[user_email] = (time.time(), folders)
+        return folders
+
+    def _find_all_meet_folders(self):
+        """Find the Meet Recordings folders of every user to process, searching per user in parallel."""
+        if not self.users_to_process:
+            return self._find_meet_folders()
+        folders = {}
+        for user_folders in self._executor.map(self._find_meet_folders, self.users_to_process):
+            folders.update((folder['id'], folder) for folder in user_folders)
+        return list(folders.values())
+
+    def _check_folder_access(self, folder):
+        """Check that a Meet Recordings folder is readable, reusing results for FOLDER_CACHE_TTL seconds."""
+        cached = self._folder_access.get(folder['id'])
+        if cached is not None and time.time() - cached[0] < self.FOLDER_CACHE_TTL:
+            return cached[1]
+        try:
+            folder_check = self._execute(self.service.files().get(
+                fileId=folder['id'],
+                fields='id,name',
+                supportsAllDrives=True
+            ))
+            logger.info(f"Successfully accessed folder: {folder_check['name']}")
+            access = True
+        except Exception as e:
+            logger.warning(f"Cannot access folder {folder.get('name', 'unknown')} ({folder['id']}). This is expected for folders we don't have access to yet. Error: {str(e)}")
+            access = False
+        self._folder_access[folder['id']] = (time.time(), access)
+        return access
+
+    def _list_folder(self, folder):
+        """List the unprocessed Google Docs in a single Meet Recordings folder."""
+        try:
+            if not self._check_folder_access(folder):
+                return []
+            files_query = (
+                f"'{folder['id']}' in parents "
+                "and mimeType = 'application/vnd.google-apps.document' "
+                "and trashed = false "
+                f"and not properties has {{ key='{self.PROCESSED_PROPERTY}' and value='true' }}"
+            )
+            logger.info(f"Searching for unprocessed Google Docs files only in folder {folder['id']}")
+            logger.info(f"Query: {files_query}")
+            batch_size = 1000  # Drive's maximum page size
+            page_token = None
+            folder_files = []
+            while True:
                 try:
-                    try:
-                        folder_check = self.service.files().get(
-                            fileId=folder['id'],
-                            fields='id,name',
-                            supportsAllDrives=True
-                        ).execute()
-                        logging.info(f"Successfully accessed folder: {folder_check['name']}")
-                    except Exception as e:
-                        logging.warning(f"Cannot access folder {folder.get('name', 'unknown')} ({folder['id']}). This is expected for folders we don't have access to yet. Error: {str(e)}")
-                        continue
-                    files_query = (
-                        f"'{folder['id']}' in parents "
-                        "and mimeType = 'application/vnd.google-apps.document' "
-                        "and trashed = false"
-                    )
-                    logging.info(f"Searching for Google Docs files only in folder {folder['id']}")
-                    logging.info(f"Query: {files_query}")
-                    batch_size = 100
-                    page_token = None
-                    files_in_folder = 0
-                    while True:
-                        try:
-                            response = self.service.files().list(
-                                q=files_query,
-                                spaces='drive',
-                                fields='nextPageToken, files(id, name, modifiedTime)',
-                                supportsAllDrives=True,
-                                includeItemsFromAllDrives=True,
-                                pageToken=page_token,
-                                pageSize=batch_size
-                            ).execute()
-                            files = response.get('files', [])
-                            if files:
-                                unprocessed_files = []
-                                for file in files:
-                                    if not self.has_been_processed(file['id']):
-                                        unprocessed_files.append(file)
-                                        logging.info(f"- {file['name']} (modified: {file['modifiedTime']}) - Not yet processed")
-                                    else:
-                                        logging.debug(f"Skipping already processed file: {file['name']}")
-                                files_in_folder += len(unprocessed_files)
-                                all_files.extend(unprocessed_files)
-                            page_token = response.get('nextPageToken')
-                            if not page_token:
-                                break
-                            logging.info(f"Processing next batch of files from folder {folder['id']}")
-                        except Exception as e:
-                            logging.warning(f"Error listing files in folder {folder['id']}, skipping page: {str(e)}")
-                            break
-                    logging.info(f"Total files found in folder {folder['id']}: {files_in_folder}")
+                    response = self._execute(self.service.files().list(
+                        q=files_query,
+                        spaces='drive',
+                        fields='nextPageToken, files(id, name, mimeType, createdTime, modifiedTime)',
+                        supportsAllDrives=True,
+                        includeItemsFromAllDrives=True,
+                        pageToken=page_token,
+                        pageSize=batch_size
+                    ))
+                    files = response.get('files', [])
+                    # Processed files are already filtered out by the query; also drop files
+                    # marked locally whose Drive property update may still be in flight
+                    if files:
+                        marked_locally = self._get_locally_processed(file['id'] for file in files)
+                        files = [file for file in files if file['id'] not in marked_locally]
+                    for file in files:
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("- %s (modified: %s) - Not yet processed", file['name'], file['modifiedTime'])
+                    folder_files.extend(files)
+                    page_token = response.get('nextPageToken')
+                    if not page_token:
+                        break
+                    logger.info(f"Processing next batch of files from folder {folder['id']}")
                 except Exception as e:
-                    logging.warning(f"Error processing folder {folder.get('name', 'unknown')} ({folder['id']}): {str(e)}")
-                    continue
-            logging.info(f"Total Google Docs files found across all accessible folders: {len(all_files)}")
-            return all_files
+                    logger.warning(f"Error listing files in folder {folder['id']}, skipping page: {str(e)}")
+                    break
+            logger.info(f"Total files found in folder {folder['id']}: {len(folder_files)}")
+            return folder_files
         except Exception as e:
-            logging.error(f"Failed to fetch Meet transcripts: {e}")
+            logger.warning(f"Error processing folder {folder.get('name', 'unknown')} ({folder['id']}): {str(e)}")
             return []
 
+    def register_change_watch(self, webhook_url, token=None, ttl_seconds=86400):
+        """Register a Drive changes.watch channel that POSTs to webhook_url whenever files change."""
+        start_page_token = self._execute(self.service.changes().getStartPageToken(supportsAllDrives=True))['startPageToken']
+        body = {
+            'id': uuid.uuid4().hex,
+            'type': 'web_hook',
+            'address': webhook_url,
+            'expiration': int((time.time() + ttl_seconds) * 1000)
+        }
+        if token:
+            body['token'] = token
+        channel = self._execute(self.service.changes().watch(
+            pageToken=start_page_token,
+            body=body,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ))
+        previous = self._get_state('change_watch_channel')
+        self._set_state('change_watch_channel', {
+            'id': channel['id'],
+            'resourceId': channel['resourceId'],
+            'expiration': int(channel.get('expiration', body['expiration']))
+        })
+        # Keep an existing page token so changes made during renewal are not skipped
+        if self._get_state('changes_page_token') is None:
+            self._set_state('changes_page_token', start_page_token)
+        logger.info(f"Registered Drive change watch channel {channel['id']} for {webhook_url}")
+        if previous:
+            try:
+                self._execute(self.service.channels().stop(body={'id': previous['id'], 'resourceId': previous['resourceId']}))
+                logger.info(f"Stopped previous Drive change watch channel {previous['id']}")
+            except Exception as e:
+                logger.warning(f"Failed to stop previous Drive change watch channel {previous['id']}: {str(e)}")
+        return channel
+
+    def ensure_change_watch(self, webhook_url, token=None, renew_before_seconds=3 * 3600):
+        """Register a change watch channel if none exists or the current one expires soon."""
+        try:
+            channel = self._get_state('change_watch_channel')
+            if channel and channel['expiration'] / 1000 - time.time() > renew_before_seconds:
+                return channel
+            return self.register_change_watch(webhook_url, token=token)
+        except Exception as e:
+            logger.error(f"Failed to register Drive change watch: {str(e)}")
+            return None
+
+    def get_changed_meet_files(self):
+        """Get unprocessed Meet transcripts among the files changed since the last notification."""
+        # Overlapping notifications must not read the same token and list the same changes twice
+        with self._changes_lock:
+            page_token = self._get_state('changes_page_token')
+            if page_token is None:
+                logger.warning("No changes page token stored; register a change watch first")
+                return []
+            changed_ids = []
+            while page_token:
+                response = self._execute(self.service.changes().list(
+                    pageToken=page_token,
+                    spaces='drive',
+                    fields='nextPageToken, newStartPageToken, changes(changeType, fileId, removed)',
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True,
+                    pageSize=1000
+                ))
+                # Shared drive changes (renames, membership) carry no fileId
+                changed_ids.extend(
+                    change['fileId'] for change in response.get('changes', [])
+                    if change.get('fileId') and not change.get('removed')
+                )
+                if 'newStartPageToken' in response:
+                    self._set_state('changes_page_token', response['newStartPageToken'])
+                page_token = response.get('nextPageToken')
+        logger.info(f"Drive reported {len(changed_ids)} changed files")
+        return self.get_meet_files_by_ids(dict.fromkeys(changed_ids))
+
+    def get_meet_files_by_ids(self, file_ids):
+        """Filter file IDs down to unprocessed Google Docs inside Meet Recordings folders."""
+        file_ids = list(file_ids)
+        marked_locally = self._get_locally_processed(file_ids)
+        file_ids = [file_id for file_id in file_ids if file_id not in marked_locally]
+        if not file_ids:
+            return []
+        meet_folder_ids = {folder['id'] for folder in self._find_all_meet_folders()}
+        files = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.warning(f"Failed to get metadata for changed file {request_id}: {str(exception)}")
+                return
+            if (response.get('mimeType') == 'application/vnd.google-apps.document'
+                    and not response.get('trashed')
+                    and response.get('properties', {}).get(self.PROCESSED_PROPERTY) != 'true'
+                    and meet_folder_ids.intersection(response.get('parents', []))):
+                files.append({key: response[key] for key in ('id', 'name', 'mimeType', 'createdTime', 'modifiedTime')})
+
+        calls = [
+            (file_id, self.service.files().get(
+                fileId=file_id,
+                fields='id, name, mimeType, createdTime, modifiedTime, parents, trashed, properties',
+                supportsAllDrives=True
+            ))
+            for file_id in file_ids
+        ]
+        self._execute_batch(calls, callback)
+        logger.info(f"Found {len(files)} unprocessed Meet transcripts among {len(file_ids)} changed files")
+        return files
+
     def create_or_get_folder(self, folder_name):
         """Create a folder if it doesn't exist, or return existing folder ID."""
         try:
@@ -128,13 +412,13 @@ class DriveAPI:
                 return self.folder_mapping[folder_name]
             
             # Search for existing folder
-            query = f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder'"
-            results = self.service.files().list(
+            query = f"name = '{_escape_drive_query_literal(folder_name)}' and mimeType = 'application/vnd.google-apps.folder'"
+            results = self._execute(self.service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name)',
                 supportsAllDrives=False
-            ).execute()
+            ))
             
             files = results.get('files', [])
             if files:
@@ -146,130 +430,240 @@ class DriveAPI:
                 'mimeType': 'application/vnd.google-apps.folder'
             }
             
-            folder = self.service.files().create(
+            folder = self._execute(self.service.files().create(
                 body=folder_metadata,
                 fields='id'
-            ).execute()
+            ))
             
             return folder['id']
             
         except Exception as e:
-            logging.error(f"Failed to create/get folder {folder_name}: {str(e)}")
+            logger.error(f"Failed to create/get folder {folder_name}: {str(e)}")
             raise
 
     def move_file(self, file_id, folder_id):
         """Move file to destination folder."""
         try:
             # Get file metadata
-            file = self.service.files().get(
+            file = self._execute(self.service.files().get(
                 fileId=file_id,
                 fields='name, parents',
                 supportsAllDrives=True
-            ).execute()
+            ))
             
             # Move file to new folder
-            self.service.files().update(
+            self._execute(self.service.files().update(
                 fileId=file_id,
                 addParents=folder_id,
                 removeParents=','.join(file.get('parents', [])),
                 fields='id, parents',
                 supportsAllDrives=True
-            ).execute()
+            ))
             
-            logging.info(f"Successfully moved file {file['name']} to folder {folder_id}")
+            logger.info(f"Successfully moved file {file['name']} to folder {folder_id}")
             return True
         except Exception as e:
-            logging.error(f"Failed to move file {file_id}: {str(e)}")
+            logger.error(f"Failed to move file {file_id}: {str(e)}")
             return False
 
     def verify_folder_access(self, folder_id):
         """Verify that we have access to the destination folder."""
         try:
-            folder = self.service.files().get(
+            folder = self._execute(self.service.files().get(
                 fileId=folder_id,
                 fields='id, name, driveId, capabilities',
                 supportsAllDrives=True
-            ).execute()
+            ))
             
-            logging.info(f"Successfully verified access to folder: {folder.get('name', 'unknown')} (ID: {folder_id})")
-            logging.info(f"Folder is in drive: {folder.get('driveId', 'personal drive')}")
-            logging.info(f"Folder capabilities: {folder.get('capabilities', {})}")
+            logger.info(f"Successfully verified access to folder: {folder.get('name', 'unknown')} (ID: {folder_id})")
+            logger.info(f"Folder is in drive: {folder.get('driveId', 'personal drive')}")
+            logger.info(f"Folder capabilities: {folder.get('capabilities', {})}")
             return True
         except Exception as e:
-            logging.error(f"Cannot access folder {folder_id}: {str(e)}")
+            logger.error(f"Cannot access folder {folder_id}: {str(e)}")
             return False
 
-    def copy_file(self, file_id, folder_id):
-        """Copy file to destination folder."""
+    def export_document_text(self, file_id, chunksize=1024 * 1024):
+        """Download a Google Doc as plain text, streamed in chunks."""
+        buffer = BytesIO()
+        # Media downloads drop the request's accept-encoding header; httplib2 still negotiates gzip itself
+        downloader = MediaIoBaseDownload(
+            buffer,
+            self.service.files().export_media(fileId=file_id, mimeType='text/plain'),
+            chunksize=chunksize
+        )
+        done = False
+        while not done:
+            _, done = downloader.next_chunk(num_retries=3)
+        return buffer.getvalue().decode('utf-8')
+
+    def append_to_document(self, doc_id, text):
+        """Append text to the end of a Google Doc's body."""
+        # endOfSegmentLocation targets the end of the body, so the document need not be fetched first
+        requests = [
+            {
+                'insertText': {
+                    'endOfSegmentLocation': {},
+                    'text': text
+                }
+            }
+        ]
+        return self._execute(self.docs_service.documents().batchUpdate(
+            documentId=doc_id,
+            body={'requests': requests}
+        ))
+
+    def copy_file(self, file_id, folder_id, verify=False):
+        """Copy file to destination folder; the copy keeps the original name."""
         try:
-            # First verify we have access to the destination folder
-            if not self.verify_folder_access(folder_id):
-                logging.error(f"Cannot access destination folder {folder_id}")
+            # Preflight access check is only useful when debugging folder permissions
+            if verify and not self.verify_folder_access(folder_id):
+                logger.error(f"Cannot access destination folder {folder_id}")
                 return False
-            # Get file metadata including the driveId
-            file = self.service.files().get(
-                fileId=file_id,
-                fields='name, driveId',
-                supportsAllDrives=True
-            ).execute()
-            # Create a copy in the destination folder
-            copied_file = self.service.files().copy(
+            copied_file = self._execute(self.service.files().copy(
                 fileId=file_id,
-                body={
-                    'name': file['name'],
-                    'parents': [folder_id]
-                },
+                body={'parents': [folder_id]},
+                fields='id, name',
                 supportsAllDrives=True
-            ).execute()
-            logging.info(f"Successfully copied file {file['name']} to shared drive folder {folder_id}")
+            ))
+            logger.info(f"Successfully copied file {copied_file.get('name', file_id)} to shared drive folder {folder_id}")
             return True
+        except HttpError as e:
+            if e.resp.status in (403, 404):
+                logger.error(f"Failed to copy file {file_id}: no access to file or destination folder {folder_id}. Ensure the folder is shared with the service account as Content Manager. Error: {str(e)}")
+            else:
+                logger.error(f"Failed to copy file {file_id} to shared drive: {str(e)}")
+            return False
         except Exception as e:
-            logging.error(f"Failed to copy file {file_id} to shared drive: {str(e)}")
+            logger.error(f"Failed to copy file {file_id} to shared drive: {str(e)}")
             return False
 
     def has_been_processed(self, file_id):
-        """Check if a file has already been processed by looking for our custom property."""
+        """Check if a file has already been processed, consulting the local index before Drive."""
         try:
-            file = self.service.files().get(
+            if self._get_locally_processed([file_id]):
+                logger.info(f"Checked processed status for file {file_id}: True (local index)")
+                return True
+            file = self._execute(self.service.files().get(
                 fileId=file_id,
                 fields='properties',
                 supportsAllDrives=True
-            ).execute()
+            ))
             processed = file.get('properties', {}).get(self.PROCESSED_PROPERTY) == 'true'
-            logging.info(f"Checked processed status for file {file_id}: {processed}")
+            if processed:
+                self._record_processed([file_id])
+            logger.info(f"Checked processed status for file {file_id}: {processed}")
             return processed
         except Exception as e:
-            logging.error(f"Failed to check if file {file_id} was processed: {str(e)}")
+            logger.error(f"Failed to check if file {file_id} was processed: {str(e)}")
             return False
 
+    def _is_retryable(self, error):
+        """Whether an HttpError is a rate limit or transient server error worth retrying."""
+        status = error.resp.status
+        # Drive reports some quota errors as 403 rateLimitExceeded/userRateLimitExceeded
+        rate_limited = status == 403 and b'ratelimitexceeded' in (error.content or b'').lower()
+        return status in (429, 500, 502, 503, 504) or rate_limited
+
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before retrying, honouring Retry-After on 429/503."""
+        if error.resp.status in (429, 503):
+            try:
+                return float(error.resp.get('retry-after'))
+            except (TypeError, ValueError):
+                pass
+        return min(2 ** attempt, 32) + random.random()
+
+    def _execute(self, req, max_tries=6):
+        """Execute an API request, backing off on rate limits and transient server errors."""
+        for attempt in range(max_tries):
+            try:
+                return req.execute()
+            except HttpError as e:
+                if not self._is_retryable(e) or attempt == max_tries - 1:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning(f"Google API returned {e.resp.status}, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_tries})")
+                time.sleep(delay)
+            except (ConnectionError, TimeoutError) as e:
+                if attempt == max_tries - 1:
+                    raise
+                delay = min(2 ** attempt, 32) + random.random()
+                logger.warning(f"Google API request failed: {str(e)}, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_tries})")
+                time.sleep(delay)
+
+    def _execute_batch(self, calls, callback, max_tries=6):
+        """Execute (request_id, request) pairs in batches of at most BATCH_SIZE calls."""
+        for start in range(0, len(calls), self.BATCH_SIZE):
+            remaining = calls[start:start + self.BATCH_SIZE]
+            for attempt in range(max_tries):
+                requests_by_id = dict(remaining)
+                retry_errors = {}
+
+                def collect(request_id, response, exception):
+                    # Calls inside a batch are rate limited individually; retry those, report the rest
+                    if (isinstance(exception, HttpError) and attempt < max_tries - 1
+                            and self._is_retryable(exception)):
+                        retry_errors[request_id] = exception
+                        return
+                    callback(request_id, response, exception)
+
+                batch = self.service.new_batch_http_request(callback=collect)
+                for request_id, request in remaining:
+                    batch.add(request, request_id=request_id)
+                self._execute(batch)
+                if not retry_errors:
+                    break
+                delay = max(self._retry_delay(error, attempt) for error in retry_errors.values())
+                logger.warning(f"{len(retry_errors)} batched calls were rate limited or failed, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_tries})")
+                time.sleep(delay)
+                remaining = [(request_id, requests_by_id[request_id]) for request_id in retry_errors]
+
     def mark_as_processed(self, file_id):
-        """Mark a file as processed by setting a custom property."""
+        """Mark a file as processed locally and set the Drive property in the background."""
         try:
-            self.service.files().update(
-                fileId=file_id,
-                body={
-                    'properties': {
-                        self.PROCESSED_PROPERTY: 'true'
-                    }
-                },
-                supportsAllDrives=True
-            ).execute()
-            logging.info(f"Marked file {file_id} as processed ({self.PROCESSED_PROPERTY}=true)")
+            self._record_processed([file_id])
+            self._executor.submit(self._sync_processed_property, file_id)
+            logger.info(f"Marked file {file_id} as processed locally, queued {self.PROCESSED_PROPERTY}=true update")
             return True
         except Exception as e:
-            logging.error(f"Failed to mark file {file_id} as processed: {str(e)}")
+            logger.error(f"Failed to mark file {file_id} as processed: {str(e)}")
             return False
 
-    def verify_document_access(self, doc_id):
+    def _sync_processed_property(self, file_id):
+        """Set the processed property on Drive, logging instead of raising on failure."""
         try:
-            doc = self.docs_service.documents().get(
+            self._set_processed_property(file_id)
+            logger.info(f"Marked file {file_id} as processed ({self.PROCESSED_PROPERTY}=true)")
+        except Exception as e:
+            logger.error(f"Failed to set {self.PROCESSED_PROPERTY} on file {file_id}: {str(e)}")
+
+    def _set_processed_property(self, file_id):
+        """Set the processed property on Drive."""
+        self._execute(self.service.files().update(
+            fileId=file_id,
+            body={
+                'properties': {
+                    self.PROCESSED_PROPERTY: 'true'
+                }
+            },
+            supportsAllDrives=True
+        ))
+
+    def verify_document_access(self, doc_id, probe_write=False):
+        """Verify read access to a document, and write access when probe_write is set."""
+        try:
+            doc = self._execute(self.docs_service.documents().get(
                 documentId=doc_id,
                 fields='title,documentId'
-            ).execute()
-            logging.info(f"Successfully accessed document: {doc.get('title', 'unknown')}")
+            ))
+            logger.info(f"Successfully accessed document: {doc.get('title', 'unknown')}")
+            if not probe_write:
+                return True
             try:
-                # Insert a single space to check write access (API does not allow empty string)
-                self.docs_service.documents().batchUpdate(
+                # Insert a single space and delete it again in the same atomic batch,
+                # so the write check leaves the document unchanged
+                self._execute(self.docs_service.documents().batchUpdate(
                     documentId=doc_id,
                     body={
                         'requests': [
@@ -280,47 +674,66 @@ class DriveAPI:
                                     },
                                     'text': ' '  # Insert a single space to satisfy the API
                                 }
+                            },
+                            {
+                                'deleteContentRange': {
+                                    'range': {
+                                        'startIndex': 1,
+                                        'endIndex': 2
+                                    }
+                                }
                             }
                         ]
                     }
-                ).execute()
-                logging.info(f"Successfully verified write access to document {doc_id}")
+                ))
+                logger.info(f"Successfully verified write access to document {doc_id}")
                 return True
             except Exception as write_error:
-                logging.error(f"No write access to document {doc_id}. Error: {str(write_error)}. Please ensure the service account has editor rights.")
+                logger.error(f"No write access to document {doc_id}. Error: {str(write_error)}. Please ensure the service account has editor rights.")
                 return False
         except Exception as e:
-            logging.error(f"Cannot access document {doc_id}: {str(e)}. Please ensure the service account has editor rights.")
+            logger.error(f"Cannot access document {doc_id}: {str(e)}. Please ensure the service account has editor rights.")
             return False
 
     def clear_all_processed_status(self):
         """Clear the processed status from all files. Use with caution!"""
         print(f"[TEST MODE] Clearing '{self.PROCESSED_PROPERTY}' property from all accessible files...")
+        with self._db_lock:
+            self.processed_db.execute("DELETE FROM processed")
+            self.processed_db.commit()
         query = f"properties has {{ key='{self.PROCESSED_PROPERTY}' and value='true' }}"
         page_token = None
         cleared_count = 0
         while True:
-            response = self.service.files().list(
+            response = self._execute(self.service.files().list(
                 q=query,
-                fields='nextPageToken, files(id, name, properties)',
+                fields='nextPageToken, files(id, name)',
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
-                pageToken=page_token
-            ).execute()
+                pageToken=page_token,
+                pageSize=1000
+            ))
             files = response.get('files', [])
-            for file in files:
-                file_id = file['id']
-                file_name = file.get('name', 'unknown')
-                try:
-                    self.service.files().update(
-                        fileId=file_id,
-                        body={'properties': {self.PROCESSED_PROPERTY: ""}},
-                        supportsAllDrives=True
-                    ).execute()
-                    print(f"Cleared '{self.PROCESSED_PROPERTY}' for file: {file_name} ({file_id})")
-                    cleared_count += 1
-                except Exception as e:
-                    print(f"Failed to clear property for file {file_name} ({file_id}): {e}")
+            names = {file['id']: file.get('name', 'unknown') for file in files}
+            cleared = []
+
+            def on_cleared(file_id, response, exception):
+                if exception is not None:
+                    print(f"Failed to clear property for file {names[file_id]} ({file_id}): {exception}")
+                    return
+                print(f"Cleared '{self.PROCESSED_PROPERTY}' for file: {names[file_id]} ({file_id})")
+                cleared.append(file_id)
+
+            calls = [
+                (file['id'], self.service.files().update(
+                    fileId=file['id'],
+                    body={'properties': {self.PROCESSED_PROPERTY: ""}},
+                    supportsAllDrives=True
+                ))
+                for file in files
+            ]
+            self._execute_batch(calls, on_cleared)
+            cleared_count += len(cleared)
             page_token = response.get('nextPageToken')
             if not page_token:
                 break
@@ -328,31 +741,41 @@ class DriveAPI:
 
     def mark_all_with_title_as_processed(self, file_title):
         """Mark all files with the given title as processed by setting the custom property."""
-        query = f"name = '{file_title.replace("'", "\\'")}' and mimeType = 'application/vnd.google-apps.document' and trashed = false"
+        query = TITLE_QUERY_TEMPLATE.format(_escape_drive_query_literal(file_title))
         page_token = None
         marked_count = 0
         while True:
-            response = self.service.files().list(
+            response = self._execute(self.service.files().list(
                 q=query,
-                fields='nextPageToken, files(id, name, properties)',
+                fields='nextPageToken, files(id)',
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
-                pageToken=page_token
-            ).execute()
+                pageToken=page_token,
+                pageSize=1000
+            ))
             files = response.get('files', [])
-            for file in files:
-                file_id = file['id']
-                try:
-                    self.service.files().update(
-                        fileId=file_id,
-                        body={'properties': {self.PROCESSED_PROPERTY: 'true'}},
-                        supportsAllDrives=True
-                    ).execute()
-                    logging.info(f"Marked file {file_id} (title: {file_title}) as processed ({self.PROCESSED_PROPERTY}=true)")
-                    marked_count += 1
-                except Exception as e:
-                    logging.error(f"Failed to mark file {file_id} (title: {file_title}) as processed: {e}")
+            marked = []
+
+            def on_marked(file_id, response, exception):
+                if exception is not None:
+                    logger.error(f"Failed to mark file {file_id} (title: {file_title}) as processed: {exception}")
+                    return
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Marked file %s (title: %s) as processed (%s=true)", file_id, file_title, self.PROCESSED_PROPERTY)
+                marked.append(file_id)
+
+            calls = [
+                (file['id'], self.service.files().update(
+                    fileId=file['id'],
+                    body={'properties': {self.PROCESSED_PROPERTY: 'true'}},
+                    supportsAllDrives=True
+                ))
+                for file in files
+            ]
+            self._execute_batch(calls, on_marked)
+            self._record_processed(marked)
+            marked_count += len(marked)
             page_token = response.get('nextPageToken')
             if not page_token:
                 break
-        logging.info(f"Marked {marked_count} files with title '{file_title}' as processed.") 
\ No newline at end of file
+        logger.info(f"Marked {marked_count} files with title '{file_title}' as processed.") 
\ No newline at end of file
@@ -1,10 +1,166 @@
 import requests
+from requests.adapters import HTTPAdapter
+import gzip
+import hashlib
 import logging
+import sqlite3
+import threading
 import time
 import json
-from tenacity import retry, stop_after_attempt, wait_exponential
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 import os
 
+# Update these categories to match your organization's meeting types
+VALID_MEETING_TYPES = frozenset({
+    "Daily Team Meeting", "Investor Meeting", "Client Meeting",
+    "HR & Recruitment", "User Research Meeting",
+    "Product Development Meeting", "Other"
+})
+
+# Normalized model output -> meeting type, covering the canonical names and common variants
+_MEETING_TYPE_ALIASES = {meeting_type.lower(): meeting_type for meeting_type in VALID_MEETING_TYPES}
+_MEETING_TYPE_ALIASES.update({
+    "daily meeting": "Daily Team Meeting",
+    "daily standup": "Daily Team Meeting",
+    "hr and recruitment": "HR & Recruitment",
+    "user research": "User Research Meeting",
+    "product development": "Product Development Meeting",
+})
+
+def _normalize_meeting_type(text):
+    """Map a model's classification answer onto VALID_MEETING_TYPES, defaulting to "Other"."""
+    key = (text or '').strip().strip('*"\'').rstrip('.').strip().lower()
+    return _MEETING_TYPE_ALIASES.get(key, "Other")
+
+# Prompt bodies; customize the meeting types in them to match VALID_MEETING_TYPES
+_CLASSIFY_PROMPT = """
+Classify the meeting into one of these types:
+- Daily Team Meeting (morning, team plans, 30-45min, daily coordination)
+- Investor Meeting
+- Client Meeting
+- HR & Recruitment
+- User Research Meeting
+- Product Development Meeting
+- Other
+
+Return ONLY the category name.
+"""
+
+_ANALYZE_PROMPT = """
+Analyze this meeting transcript and return a JSON object with these fields:
+
+"meeting_type": classify the meeting into exactly one of these types:
+- Daily Team Meeting (morning, team plans, 30-45min, daily coordination)
+- Investor Meeting
+- Client Meeting
+- HR & Recruitment
+- User Research Meeting
+- Product Development Meeting
+- Other
+
+"summary": a concise summary focusing on:
+- Key discussion points
+- Important decisions made
+- Action items or next steps
+- Project updates
+
+"chat_summary": ONLY for a Daily Team Meeting, otherwise an empty string. A ready to go Google Chat message with styling applied and emojis if needed. Focus on:
+- Key decisions, action items, main discussion points and plans for the day/week (if applicable)
+- Seperate to instructions and updates per person referred to in the transcript.
+- Try to keep it concise, but don't leave out any key information.
+- Split it into "Updates" and "Action Points" sections.
+
+"validation_summary": ONLY for a User Research Meeting or Product Development Meeting, otherwise an empty string. A ready to go Google Chat message with styling applied and emojis if needed, focusing on:
+- User feedback and pain points
+- Features discussed, both existing and new/upcoming
+- User behavior and usage patterns
+- Validation of assumptions
+- Key insights and learnings
+- Critical feedback, development tasks or possible features/methods discussed, and specific quotes from users
+- A "Next Steps" section with actionable items
+
+For chat_summary and validation_summary use:
+- Actual Unicode emojis (e.g., 👍, 🔥, 📌) at the start of each section and for highlights.
+- Bullet points using '-' or '•' (not '*').
+- *bold* for section headers and important points.
+- No Markdown that Google Chat does not support.
+- No :emoji_name: shortcodes, only real emoji characters.
+"""
+
+_SUMMARY_PROMPT = """
+Provide a concise summary focusing on:
+- Key discussion points
+- Important decisions made
+- Action items or next steps
+- Project updates
+"""
+
+_CHAT_PROMPT = """
+Summarize this meeting for a Google Chat message, output should be a ready to go message with styling applied and emojis if needed. Focus on:
+- Key decisions
+- Action items
+- Main discussion points
+- Plans for the day/week (if applicable)
+- Keep it concise and actionable for the team.
+- Seperate to instructions and updates per person referred to in the transcript.
+- Try to keep it concise, but don't leave out any key information.
+- Split it into "Updates" and "Action Points" sections.
+- Actual Unicode emojis (e.g., 👍, 🔥, 📌) at the start of each section and for highlights.
+- Bullet points using '-' or '•' (not '*').
+- Use *bold* for section headers and important points.
+- No Markdown that Google Chat does not support.
+- No :emoji_name: shortcodes, only real emoji characters.
+"""
+
+_VALIDATION_PROMPT = """
+Create a user validation meeting summary for a Google Chat message, output should be a ready to go message with styling applied and emojis if needed, focusing on:
+- User feedback and pain points
+- Features discussed, both existing and new/upcoming
+- User behavior and usage patterns
+- Validation of assumptions
+- Key insights and learnings
+- Next steps and follow-up actions
+
+Format the output with:
+- Clear sections with emojis
+- Highlight critical feedback
+- Highlight development tasks or possible features/methods discussed 
+- Include any specific quotes from users
+- Add a "Next Steps" section with actionable items
+
+- Actual Unicode emojis (e.g., 👍, 🔥, 📌) at the start of each section and for highlights.
+- Bullet points using '-' or '•' (not '*').
+- Use *bold* for section headers and important points.
+- No Markdown that Google Chat does not support.
+- No :emoji_name: shortcodes, only real emoji characters.
+
+Keep it comprehensive, focusing on development areas, and don't leave out any key information or important discussions.
+"""
+
+class PromptTooLongError(Exception):
+    """Raised when Gemini rejects a prompt for exceeding the model's context window."""
+
+def _is_retryable(exception):
+    """Retry transient failures only; other client errors (bad key, config or schema) fail the same way again."""
+    if isinstance(exception, PromptTooLongError):
+        return False
+    if isinstance(exception, requests.HTTPError) and exception.response is not None:
+        status = exception.response.status_code
+        return not (400 <= status < 500 and status != 429)
+    return True
+
+@dataclass
+class MeetingAnalysis:
+    """Result of a single combined classification and summary request."""
+    meeting_type: str
+    doc_summary: str
+    chat_summary: str = ''
+    validation_summary: str = ''
+
 class GeminiAPI:
     def __init__(self, api_key):
         """Initialize Gemini API client using REST transport."""
@@ -13,75 +169,194 @@ class GeminiAPI:
             
         self.api_key = api_key
         self.model = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
-        self.base_url = f"https://generativelanguage.googleapis.com/v1/models/{self.model}:generateContent"
-        self.requests_in_minute = 0
-        self.last_request_time = time.time()
-        self.MAX_CHUNK_SIZE = 30000
+        # Streamed as server-sent events so output is received while it is generated
+        self.base_url = f"https://generativelanguage.googleapis.com/v1/models/{self.model}:streamGenerateContent?alt=sse"
+        # Token bucket allowing bursts of 55 requests, refilled at 55 per minute
+        self.RATE_LIMIT_CAPACITY = 55.0
+        self._rate = 55 / 60
+        self._tokens = self.RATE_LIMIT_CAPACITY
+        self._last_refill = time.monotonic()
+        self._rate_limit_lock = threading.Lock()
+        # Whole transcripts fit comfortably in the model's context window (~175k tokens)
+        self.MAX_CHUNK_SIZE = 700_000
+        # Used for map-reduce summaries only when a prompt is rejected as too long
+        self.FALLBACK_CHUNK_SIZE = 30000
+        # Classification only needs the start of the transcript
+        self.CLASSIFY_EXCERPT_SIZE = 30000
+        self._last_chunks = None
+        # Upper bound on Gemini requests in flight at once (e.g. per-chunk summaries)
+        self.MAX_CONCURRENT_REQUESTS = 10
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_REQUESTS, thread_name_prefix='gemini')
+        # Responses to identical prompts (duplicate uploads, retried files) are reused within the process
+        self.RESPONSE_CACHE_SIZE = 512
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        # Responses also persist on disk so restarts and re-runs of the same files skip the API
+        self.DISK_CACHE_TTL = 7 * 86400
+        self._setup_disk_cache(os.getenv('GEMINI_CACHE_PATH', 'gemini_cache.db'))
         
         # Configure session for REST calls
         self.session = requests.Session()
+        # Responses are gzip-encoded by default (requests sends Accept-Encoding: gzip, deflate);
+        # gzipping request bodies is opt-in since not every endpoint accepts Content-Encoding on uploads
+        self.compress_requests = os.getenv('GEMINI_COMPRESS_REQUESTS') == '1'
+        # Keep enough pooled connections for every concurrent request; retries are handled by tenacity
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+        self.session.mount('https://', adapter)
         self.session.headers.update({
             'Content-Type': 'application/json',
             'x-goog-api-key': self.api_key
         })
         
-        # Test the connection
+        # Optionally validate the key up front with a free model lookup instead of a billable generation
+        if os.getenv('GEMINI_HEALTHCHECK') == '1':
+            self._check_connection()
+        logging.info("Successfully initialized Gemini API with REST transport")
+
+    def _check_connection(self):
+        """Verify the API key can access the configured model."""
         try:
-            self._generate_with_retry("Test connection.")
-            logging.info("Successfully initialized Gemini API with REST transport")
+            response = self.session.get(
+                f"https://generativelanguage.googleapis.com/v1/models/{self.model}",
+                timeout=10
+            )
         except Exception as e:
-            if "invalid api key" in str(e).lower():
-                raise ValueError("Invalid Gemini API key provided")
-            elif "permission denied" in str(e).lower():
-                raise ValueError("API key does not have permission to access Gemini API")
-            else:
-                logging.error(f"Failed to initialize Gemini API: {str(e)}")
-                raise
+            logging.error(f"Failed to initialize Gemini API: {str(e)}")
+            raise
+        if response.status_code == 400:
+            raise ValueError("Invalid Gemini API key provided")
+        if response.status_code == 403:
+            raise ValueError("API key does not have permission to access Gemini API")
+        if response.status_code == 404:
+            raise ValueError(f"Gemini model {self.model} is not available")
+        response.raise_for_status()
 
     def _check_rate_limit(self):
         """Implement rate limiting to stay within API quotas."""
-        current_time = time.time()
-        if current_time - self.last_request_time >= 60:
-            self.requests_in_minute = 0
-            self.last_request_time = current_time
-        
-        if self.requests_in_minute >= 55:
-            sleep_time = 60 - (current_time - self.last_request_time)
-            if sleep_time > 0:
-                logging.info(f"Rate limit approaching, waiting {sleep_time:.2f} seconds")
-                time.sleep(sleep_time)
-                self.requests_in_minute = 0
-                self.last_request_time = time.time()
-        
-        self.requests_in_minute += 1
+        with self._rate_limit_lock:
+            now = time.monotonic()
+            self._tokens = min(self.RATE_LIMIT_CAPACITY, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            # Reserve a token up front; a negative balance queues concurrent callers behind each other
+            self._tokens -= 1
+            sleep_time = -self._tokens / self._rate if self._tokens < 0 else 0
+
+        if sleep_time > 0:
+            logging.info(f"Rate limit approaching, waiting {sleep_time:.2f} seconds")
+            time.sleep(sleep_time)
 
-    def _chunk_content(self, content):
+    def _chunk_content(self, content, size=None):
         """Split content into manageable chunks."""
-        if len(content) <= self.MAX_CHUNK_SIZE:
+        size = size or self.MAX_CHUNK_SIZE
+        if len(content) <= size:
             return [content]
-        
+
+        # The same transcript is usually split more than once (classification, then summary)
+        last = self._last_chunks
+        if last is not None and last[0] is content and last[1] == size:
+            return last[2]
+
+        # Cut at the last newline within each window; a single overlong line is split hard
         chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for line in content.split('\n'):
-            line_size = len(line) + 1
-            if current_size + line_size > self.MAX_CHUNK_SIZE:
-                if current_chunk:
-                    chunks.append('\n'.join(current_chunk))
-                current_chunk = [line]
-                current_size = line_size
-            else:
-                current_chunk.append(line)
-                current_size += line_size
-        
-        if current_chunk:
-            chunks.append('\n'.join(current_chunk))
-        
+        start = 0
+        length = len(content)
+        while start < length:
+            end = min(start + size, length)
+            if end < length:
+                newline = content.rfind('\n', start, end)
+                if newline > start:
+                    end = newline
+            chunks.append(content[start:end])
+            start = end + 1 if content.startswith('\n', end) else end
+
+        self._last_chunks = (content, size, chunks)
         return chunks
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    def _setup_disk_cache(self, path):
+        """Open the on-disk response cache and drop expired entries."""
+        self._disk_cache_lock = threading.Lock()
+        self.disk_cache = sqlite3.connect(path, check_same_thread=False)
+        self.disk_cache.execute('PRAGMA journal_mode=WAL')
+        self.disk_cache.execute('PRAGMA synchronous=NORMAL')
+        self.disk_cache.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires_at INTEGER)')
+        self.disk_cache.execute('DELETE FROM responses WHERE expires_at < ?', (int(time.time()),))
+        self.disk_cache.commit()
+
+    def _get_cached_response(self, key):
+        """Look up a response in the memory cache, then on disk."""
+        with self._response_cache_lock:
+            if key in self._response_cache:
+                self._response_cache.move_to_end(key)
+                return self._response_cache[key]
+        with self._disk_cache_lock:
+            row = self.disk_cache.execute(
+                'SELECT value FROM responses WHERE key = ? AND expires_at >= ?', (key, int(time.time()))
+            ).fetchone()
+        if row is None:
+            return None
+        self._remember_response(key, row[0])
+        return row[0]
+
+    def _remember_response(self, key, result):
+        """Store a response in the in-memory LRU."""
+        with self._response_cache_lock:
+            self._response_cache[key] = result
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+
+    def _forget_response(self, key):
+        """Drop a response from both caches."""
+        with self._response_cache_lock:
+            self._response_cache.pop(key, None)
+        try:
+            with self._disk_cache_lock:
+                self.disk_cache.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.disk_cache.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to remove Gemini response from disk cache: {str(e)}")
+
+    def _cache_key(self, prompt, generation_config):
+        """Hash the model, generation config and prompt into a response cache key."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.model}|{json.dumps(generation_config, sort_keys=True)}|".encode('utf-8'))
+        digest.update(prompt.encode('utf-8'))
+        return digest.hexdigest()
+
     def _generate_with_retry(self, prompt, generation_config=None):
+        """Generate content, reusing the response to an identical earlier prompt from memory or disk."""
+        generation_config = generation_config or {
+            'temperature': 0.7,
+            'top_p': 0.8,
+            'top_k': 40,
+            'max_output_tokens': 2048,
+        }
+        key = self._cache_key(prompt, generation_config)
+        cached = self._get_cached_response(key)
+        if cached is not None:
+            logging.info("Reusing cached Gemini response for identical prompt")
+            return cached
+
+        result = self._call_api(prompt, generation_config)
+
+        self._remember_response(key, result)
+        try:
+            with self._disk_cache_lock:
+                self.disk_cache.execute(
+                    'INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, result, int(time.time()) + self.DISK_CACHE_TTL)
+                )
+                self.disk_cache.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to persist Gemini response to disk cache: {str(e)}")
+        return result
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception(_is_retryable)
+    )
+    def _call_api(self, prompt, generation_config):
         """Make API call with retry logic."""
         self._check_rate_limit()
         try:
@@ -91,146 +366,191 @@ class GeminiAPI:
                     logging.info(f"Content split into {len(chunks)} chunks")
                     prompt = chunks[0]
             
-            generation_config = generation_config or {
-                'temperature': 0.7,
-                'top_p': 0.8,
-                'top_k': 40,
-                'max_output_tokens': 2048,
-            }
-            
-            payload = {
-                "contents": [{
-                    "parts": [{
-                        "text": prompt
-                    }]
-                }],
-                "generationConfig": generation_config
-            }
-            
-            response = self.session.post(
-                self.base_url,
-                json=payload
-            )
-            
-            if response.status_code == 429:
-                logging.warning("Rate limit hit, retrying with backoff...")
-                time.sleep(5)
-                raise Exception("Rate limit exceeded")
-                
-            response.raise_for_status()
-            result = response.json()
-            
-            if not result.get("candidates"):
+            result = ''.join(self._generate_stream(prompt, generation_config))
+            if not result:
                 raise Exception("Empty response from Gemini API")
                 
-            return result["candidates"][0]["content"]["parts"][0]["text"].strip()
+            return result.strip()
             
         except Exception as e:
             logging.error(f"Error generating content: {str(e)}")
             raise
 
+    def _generate_stream(self, prompt, generation_config):
+        """Yield response text fragments as Gemini streams them."""
+        payload = {
+            "contents": [{
+                "parts": [{
+                    "text": prompt
+                }]
+            }],
+            "generationConfig": generation_config
+        }
+
+        # Transcripts make for large bodies; orjson serializes them much faster than the stdlib
+        body = orjson.dumps(payload)
+        headers = None
+        if self.compress_requests:
+            body = gzip.compress(body, compresslevel=6)
+            headers = {'Content-Encoding': 'gzip'}
+
+        with self.session.post(self.base_url, data=body, headers=headers, stream=True) as response:
+            if response.status_code == 429:
+                logging.warning("Rate limit hit, retrying with backoff...")
+                time.sleep(5)
+                raise Exception("Rate limit exceeded")
+            if response.status_code == 400 and 'exceeds the maximum number of tokens' in response.text:
+                raise PromptTooLongError(response.text)
+
+            response.raise_for_status()
+            for line in response.iter_lines():
+                # Each server-sent event carries one partial GenerateContentResponse
+                if not line.startswith(b'data: '):
+                    continue
+                chunk = orjson.loads(line[len(b'data: '):])
+                for candidate in chunk.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if "text" in part:
+                            yield part["text"]
+
     def determine_meeting_type(self, transcript_text, document_name=None):
         """Determine meeting type from transcript content using Gemini API."""
         try:
-            # Create a more concise prompt for classification
-            # Customize these meeting types based on your organization's needs
-            prompt = """
-            Classify the meeting into one of these types:
-            - Daily Team Meeting (morning, team plans, 30-45min, daily coordination)
-            - Investor Meeting
-            - Client Meeting
-            - HR & Recruitment
-            - User Research Meeting
-            - Product Development Meeting
-            - Other
-            
-            Return ONLY the category name.
-            """
+            prompt = _CLASSIFY_PROMPT
             
             if document_name:
                 prompt += f"\n\nDocument name: {document_name}\n"
             
             # Use only the first part of transcript for classification
-            content_chunk = self._chunk_content(transcript_text)[0]
+            content_chunk = self._chunk_content(transcript_text, self.CLASSIFY_EXCERPT_SIZE)[0]
             prompt += f"\nTranscript excerpt:\n{content_chunk}"
             
-            result = self._generate_with_retry(prompt)
-            
-            # Update these categories to match your organization's meeting types
-            valid_categories = {
-                "Daily Team Meeting", "Investor Meeting", "Client Meeting",
-                "HR & Recruitment", "User Research Meeting", 
-                "Product Development Meeting", "Other"
+            # The answer is a category name, a few tokens at most
+            generation_config = {
+                'temperature': 0.7,
+                'top_p': 0.8,
+                'top_k': 40,
+                'max_output_tokens': 16,
             }
+            result = self._generate_with_retry(prompt, generation_config)
             
-            return result if result in valid_categories else "Other"
+            return _normalize_meeting_type(result)
             
         except Exception as e:
             logging.error(f"Failed to determine meeting type: {str(e)}")
             return "Other"
 
+    def analyze_meeting(self, transcript_text, document_name=None):
+        """Classify and summarize a meeting in one Gemini call; returns None if the caller should fall back to separate calls."""
+        try:
+            prompt = _ANALYZE_PROMPT
+            if document_name:
+                prompt += f"\n\nDocument name: {document_name}\n"
+            prompt += f"\nTranscript:\n{transcript_text}"
+
+            if len(prompt) > self.MAX_CHUNK_SIZE:
+                logging.info("Transcript too long for a single combined analysis, using separate calls")
+                return None
+
+            generation_config = {
+                'temperature': 0.7,
+                'top_p': 0.8,
+                'top_k': 40,
+                'max_output_tokens': 4096,
+                'responseMimeType': 'application/json',
+                'responseSchema': {
+                    'type': 'OBJECT',
+                    'properties': {
+                        'meeting_type': {'type': 'STRING'},
+                        'summary': {'type': 'STRING'},
+                        'chat_summary': {'type': 'STRING'},
+                        'validation_summary': {'type': 'STRING'}
+                    },
+                    'required': ['meeting_type', 'summary']
+                }
+            }
+            result = self._generate_with_retry(prompt, generation_config)
+            analysis = self._parse_analysis(result)
+            if analysis is None:
+                # Don't replay an unusable (e.g. truncated) response when the file is retried
+                self._forget_response(self._cache_key(prompt, generation_config))
+            return analysis
+
+        except Exception as e:
+            logging.error(f"Failed to analyze meeting: {str(e)}")
+            return None
+
+    def _parse_analysis(self, result):
+        """Parse the combined analysis JSON, returning None if it is unusable."""
+        try:
+            # Tolerate a fenced code block in case the JSON mime type is ignored
+            result = result.strip().removeprefix('```json').removeprefix('```').removesuffix('```')
+            data = orjson.loads(result)
+            analysis = MeetingAnalysis(
+                meeting_type=_normalize_meeting_type(data.get('meeting_type')),
+                doc_summary=(data.get('summary') or '').strip(),
+                chat_summary=(data.get('chat_summary') or '').strip(),
+                validation_summary=(data.get('validation_summary') or '').strip()
+            )
+        except Exception as e:
+            logging.error(f"Failed to parse combined analysis, using separate calls: {str(e)}")
+            return None
+        if not analysis.doc_summary:
+            logging.warning("Combined analysis returned an empty summary, using separate calls")
+            return None
+        return analysis
+
     def summarize_transcript(self, transcript_text):
         """Summarize meeting transcript using Gemini API."""
         try:
-            chunks = self._chunk_content(transcript_text)
-            if len(chunks) == 1:
-                # Single chunk, process normally
-                prompt = """
-                Provide a concise summary focusing on:
-                - Key discussion points
-                - Important decisions made
-                - Action items or next steps
-                - Project updates
-                """
-                prompt += f'\n\nTranscript:\n{chunks[0]}'
-                return self._generate_with_retry(prompt)
-            else:
-                # Multiple chunks, process each and combine
-                logging.info(f"Processing transcript in {len(chunks)} chunks")
-                summaries = []
-                for i, chunk in enumerate(chunks):
-                    prompt = f"""
-                    Summarize part {i+1}/{len(chunks)} of the transcript, focusing on:
-                    - Key points
-                    - Decisions
-                    - Action items
-                    """
-                    prompt += f'\n\nTranscript part {i+1}:\n{chunk}'
-                    summary = self._generate_with_retry(prompt)
-                    if summary:
-                        summaries.append(summary)
-                
-                # Combine summaries
-                if summaries:
-                    combined_prompt = "Combine these summary parts into a coherent final summary:\n\n"
-                    combined_prompt += "\n\n".join(f"Part {i+1}:\n{summary}" for i, summary in enumerate(summaries))
-                    return self._generate_with_retry(combined_prompt)
-                
-            return None
+            if len(transcript_text) <= self.MAX_CHUNK_SIZE:
+                # The whole transcript fits in the context window, summarize it in one call
+                prompt = _SUMMARY_PROMPT
+                prompt += f'\n\nTranscript:\n{transcript_text}'
+                generation_config = {
+                    'temperature': 0.7,
+                    'top_p': 0.8,
+                    'top_k': 40,
+                    'max_output_tokens': 4096,
+                }
+                try:
+                    return self._generate_with_retry(prompt, generation_config)
+                except PromptTooLongError:
+                    logging.warning("Transcript exceeds the model context window, falling back to chunked summaries")
+
+            return self._summarize_in_chunks(transcript_text)
             
         except Exception as e:
             logging.error(f"Failed to summarize transcript: {str(e)}")
             return None
 
+    def _summarize_in_chunks(self, transcript_text):
+        """Summarize transcript chunks concurrently and combine them into one summary."""
+        chunks = self._chunk_content(transcript_text, self.FALLBACK_CHUNK_SIZE)
+        logging.info(f"Processing transcript in {len(chunks)} chunks")
+        prompts = []
+        for i, chunk in enumerate(chunks):
+            prompt = f"""
+            Summarize part {i+1}/{len(chunks)} of the transcript, focusing on:
+            - Key points
+            - Decisions
+            - Action items
+            """
+            prompt += f'\n\nTranscript part {i+1}:\n{chunk}'
+            prompts.append(prompt)
+        summaries = [summary for summary in self._executor.map(self._generate_with_retry, prompts) if summary]
+
+        # Combine summaries
+        if summaries:
+            combined_prompt = "Combine these summary parts into a coherent final summary:\n\n"
+            combined_prompt += "\n\n".join(f"Part {i+1}:\n{summary}" for i, summary in enumerate(summaries))
+            return self._generate_with_retry(combined_prompt)
+        return None
+
     def generate_chat_summary(self, transcript_text, meeting_time=None):
         """Generate a concise, action-oriented summary for Google Chat."""
         try:
-            prompt = """
-            Summarize this meeting for a Google Chat message, output should be a ready to go message with styling applied and emojis if needed. Focus on:
-            - Key decisions
-            - Action items
-            - Main discussion points
-            - Plans for the day/week (if applicable)
-            - Keep it concise and actionable for the team.
-            - Seperate to instructions and updates per person referred to in the transcript.
-            - Try to keep it concise, but don't leave out any key information.
-            - Split it into "Updates" and "Action Points" sections.
-            - Actual Unicode emojis (e.g., 👍, 🔥, 📌) at the start of each section and for highlights.
-            - Bullet points using '-' or '•' (not '*').
-            - Use *bold* for section headers and important points.
-            - No Markdown that Google Chat does not support.
-            - No :emoji_name: shortcodes, only real emoji characters.
-            """
+            prompt = _CHAT_PROMPT
             if meeting_time:
                 prompt += f"\nMeeting time: {meeting_time}"
             prompt += f"\n\nTranscript:\n{transcript_text}"  # Limit to first 3000 chars for brevity
@@ -245,30 +565,7 @@ class GeminiAPI:
     def generate_user_validation_summary(self, transcript_text, meeting_time=None):
         """Generate a specialized summary for user validation meetings."""
         try:
-            prompt = """
-            Create a user validation meeting summary for a Google Chat message, output should be a ready to go message with styling applied and emojis if needed, focusing on:
-            - User feedback and pain points
-            - Features discussed, both existing and new/upcoming
-            - User behavior and usage patterns
-            - Validation of assumptions
-            - Key insights and learnings
-            - Next steps and follow-up actions
-            
-            Format the output with:
-            - Clear sections with emojis
-            - Highlight critical feedback
-            - Highlight development tasks or possible features/methods discussed 
-            - Include any specific quotes from users
-            - Add a "Next Steps" section with actionable items
-
-            - Actual Unicode emojis (e.g., 👍, 🔥, 📌) at the start of each section and for highlights.
-            - Bullet points using '-' or '•' (not '*').
-            - Use *bold* for section headers and important points.
-            - No Markdown that Google Chat does not support.
-            - No :emoji_name: shortcodes, only real emoji characters.
-            
-            Keep it comprehensive, focusing on development areas, and don't leave out any key information or important discussions.
-            """
+            prompt = _VALIDATION_PROMPT
             if meeting_time:
                 prompt += f"\nMeeting time: {meeting_time}"
             prompt += f"\n\nTranscript:\n{transcript_text}"  # Limit to first 3000 chars for brevity
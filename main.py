@@ -1,7 +1,12 @@
 import os
 import json
 import logging
-from datetime import datetime
+import re
+import redis
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from drive_api import DriveAPI
 from gemini_api import GeminiAPI
 from chat_api import ChatAPI
@@ -25,6 +30,70 @@ drive_logger.setLevel(logging.INFO)
 
 app = Flask(__name__)
 
+# Users are independent, so their files are processed concurrently
+MAX_USER_WORKERS = 8
+
+# Copies, processed markers and chat notifications run in the background, bounded per batch
+MAX_IO_WORKERS = 16
+_io_executor = ThreadPoolExecutor(max_workers=MAX_IO_WORKERS, thread_name_prefix='io')
+
+# Transcripts analyzed at once across all users; bounds concurrent exports, Gemini calls and Docs writes
+MAX_FILE_WORKERS = 4
+_file_executor = ThreadPoolExecutor(max_workers=MAX_FILE_WORKERS, thread_name_prefix='file')
+
+# Meeting time is the first word of the third " - " separated part of a Meet file name
+_TIME_RE = re.compile(r'^.*? - .*? - ([^ ]*)')
+
+# API clients are built once per process and shared across requests
+_apis = None
+_apis_lock = threading.Lock()
+
+class ProcessedTitles:
+    """Thread-safe set of file titles already handled in the current run."""
+    def __init__(self):
+        self._titles = set()
+        self._lock = threading.Lock()
+
+    def claim(self, title):
+        """Record a title, returning False if another file with it was already claimed."""
+        with self._lock:
+            if title in self._titles:
+                return False
+            self._titles.add(title)
+            return True
+
+class RedisProcessedTitles:
+    """Title claims shared through Redis so concurrent instances don't process the same meeting."""
+    # Claims are leases: files whose processing failed are picked up again once they expire,
+    # while successfully processed files are excluded by their Drive property instead
+    CLAIM_TTL = 3600
+
+    def __init__(self, client):
+        self.client = client
+        self._local = ProcessedTitles()
+
+    def claim(self, title):
+        """Claim a title across instances, falling back to this run only if Redis is unavailable."""
+        if not self._local.claim(title):
+            return False
+        try:
+            return bool(self.client.set(f"processed:{title}", 1, nx=True, ex=self.CLAIM_TTL))
+        except Exception as e:
+            logging.warning(f"Failed to claim title {title} in Redis, claiming locally only: {str(e)}")
+            return True
+
+@lru_cache(maxsize=None)
+def _redis_client(redis_url):
+    """Return a Redis client for the URL, shared across runs."""
+    return redis.Redis.from_url(redis_url, decode_responses=True)
+
+def new_processed_titles():
+    """Create the duplicate-title tracker for a run, shared through Redis when REDIS_URL is set."""
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        return RedisProcessedTitles(_redis_client(redis_url))
+    return ProcessedTitles()
+
 def setup_apis():
     """Initialize API clients."""
     try:
@@ -42,7 +111,7 @@ def setup_apis():
         drive_api = DriveAPI(folder_mapping=folder_mapping, users_to_process=users_to_process)
         gemini_api = GeminiAPI(api_key)
         chat_api = ChatAPI(os.getenv('CHAT_WEBHOOK_URL'))
-        validation_chat_api = ChatAPI(os.getenv('VALIDATION_CHAT_WEBHOOK_URL'))
+        validation_chat_api = ChatAPI(os.getenv('VALIDATION_CHAT_WEBHOOK_URL'), session=chat_api.session)
         
         return drive_api, gemini_api, chat_api, validation_chat_api
     except ValueError as ve:
@@ -52,6 +121,15 @@ def setup_apis():
         logging.error(f"Failed to setup APIs: {str(e)}")
         raise
 
+def get_apis():
+    """Return the shared API clients, creating them on first use."""
+    global _apis
+    if _apis is None:
+        with _apis_lock:
+            if _apis is None:
+                _apis = setup_apis()
+    return _apis
+
 def process_meet_files(drive_api, gemini_api, chat_api, validation_chat_api, user_email, processed_titles):
     """Process new Meet files for a user."""
     # No clearing of processed statuses
@@ -61,155 +139,183 @@ def process_meet_files(drive_api, gemini_api, chat_api, validation_chat_api, use
         if not new_files:
             logging.info(f"No new Meet files found for user {user_email}")
             return
-        logging.info(f"Found {len(new_files)} files to process")
-        today = datetime.now().date()
-        batch_size = 10
-        for i in range(0, len(new_files), batch_size):
-            batch = new_files[i:i + batch_size]
-            logging.info(f"Processing batch {i//batch_size + 1} of {(len(new_files) + batch_size - 1)//batch_size}")
-            for file in batch:
-                try:
-                    file_metadata = drive_api.service.files().get(
-                        fileId=file['id'],
-                        fields='mimeType,name,createdTime',
-                        supportsAllDrives=True
-                    ).execute()
-                    mime_type = file_metadata.get('mimeType')
-                    file_name = file_metadata.get('name', file.get('name', 'unknown'))
-                    created_time = datetime.fromisoformat(file_metadata.get('createdTime').replace('Z', '+00:00'))
-                    if created_time.date() != today:
-                        logging.info(f"Skipping file {file_name} as it wasn't created today")
-                        continue
-                    if file_name in processed_titles:
-                        logging.info(f"Skipping duplicate file title in this run: {file_name}")
-                        continue
-                    processed_titles.add(file_name)
-                    logging.info(f"Processing file: {file_name} (type: {mime_type})")
-                    if mime_type == 'application/vnd.google-apps.document':
-                        doc = drive_api.service.files().export(
-                            fileId=file['id'],
-                            mimeType='text/plain'
-                        ).execute()
-                        if not doc:
-                            logging.warning(f"No content found in document: {file_name}")
-                            continue
-                        content = doc.decode('utf-8') if isinstance(doc, bytes) else doc
-                        logging.info(f"Sending content to Gemini for file: {file_name}")
-                        meeting_type = gemini_api.determine_meeting_type(content, document_name=file_name)
-                        logging.info(f"Determined meeting type: {meeting_type} for file: {file_name}")
-                        doc_summary = gemini_api.summarize_transcript(content)
-                        logging.info(f"Gemini document summary for {file_name}: {repr(doc_summary)}")
-                        if not doc_summary:
-                            logging.warning(f"Gemini summary was empty for file: {file_name}. Skipping summary insertion.")
-                            continue
-                        summary_text = f"\n\n=== AI-Generated Summary ===\n{doc_summary}\n"
-                        try:
-                            document = drive_api.docs_service.documents().get(documentId=file['id']).execute()
-                            logging.info(f"Successfully retrieved document structure for {file_name}")
-                            content_items = document.get('body', {}).get('content', [])
-                            end_index = None
-                            for item in reversed(content_items):
-                                if 'endIndex' in item and not item.get('sectionBreak'):
-                                    end_index = item['endIndex']
-                                    logging.debug(f"Found end index: {end_index} in content item: {item}")
-                                    break
-                            if end_index is None:
-                                logging.warning("No valid end index found, defaulting to 1")
-                                end_index = 1
-                            requests = [
-                                {
-                                    'insertText': {
-                                        'location': {
-                                            'index': end_index - 1
-                                        },
-                                        'text': summary_text
-                                    }
-                                }
-                            ]
-                            drive_api.docs_service.documents().batchUpdate(
-                                documentId=file['id'],
-                                body={'requests': requests}
-                            ).execute()
-                            logging.info(f"Successfully added summary to document: {file_name}")
-                        except Exception as update_error:
-                            logging.error(f"Failed to update document with summary for {file_name}: {str(update_error)}. Ensure the service account has editor rights.")
-                            continue
-                        if meeting_type in drive_api.folder_mapping:
-                            destination_folder = drive_api.folder_mapping[meeting_type]
-                            logging.info(f"Copying file {file_name} to folder: {meeting_type}")
-                            if drive_api.copy_file(file['id'], destination_folder):
-                                logging.info(f"Successfully copied file {file_name}")
-                                drive_api.mark_all_with_title_as_processed(file_name)
-                                logging.info(f"Successfully marked all files with title {file_name} as processed")
-                                if meeting_type == "Daily Team Meeting":
-                                    meeting_time = None
-                                    if " - " in file_name:
-                                        try:
-                                            time_part = file_name.split(" - ")[2].split(" ")[0]
-                                            meeting_time = time_part
-                                        except:
-                                            pass
-                                    logging.info(f"Generating chat summary for daily meeting: {file_name}")
-                                    chat_summary = gemini_api.generate_chat_summary(content, meeting_time)
-                                    logging.info(f"Gemini chat summary for {file_name}: {repr(chat_summary)}")
-                                    if chat_summary:
-                                        logging.info(f"Sending chat summary for {file_name} to Google Chat")
-                                        chat_api.send_daily_meeting_summary([{'name': file_name, 'summary': chat_summary}])
-                                    else:
-                                        logging.error(f"Failed to generate chat summary for {file_name}")
-                                elif meeting_type in ["User Research Meeting", "Product Development Meeting"]:
-                                    meeting_time = None
-                                    if " - " in file_name:
-                                        try:
-                                            time_part = file_name.split(" - ")[2].split(" ")[0]
-                                            meeting_time = time_part
-                                        except:
-                                            pass
-                                    logging.info(f"Generating user validation summary for meeting: {file_name}")
-                                    validation_summary = gemini_api.generate_user_validation_summary(content, meeting_time)
-                                    logging.info(f"Gemini user validation summary for {file_name}: {repr(validation_summary)}")
-                                    if validation_summary:
-                                        logging.info(f"Sending user validation summary for {file_name} to Google Chat")
-                                        validation_chat_api.send_daily_meeting_summary([{'name': file_name, 'summary': validation_summary}])
-                                    else:
-                                        logging.error(f"Failed to generate user validation summary for {file_name}")
-                            else:
-                                logging.error(f"Failed to copy file {file_name}")
-                        else:
-                            logging.warning(f"Unknown meeting type '{meeting_type}' for file: {file_name}")
-                    else:
-                        logging.info(f"Skipping non-Google Doc file: {file_name}")
-                except Exception as e:
-                    logging.error(f"Error processing file {file.get('name', 'unknown')}: {str(e)}")
-                    continue
-            logging.info(f"Completed processing batch {i//batch_size + 1}")
+        process_files(drive_api, gemini_api, chat_api, validation_chat_api, new_files, processed_titles)
     except Exception as e:
         logging.error(f"Failed to process Meet files: {str(e)}")
         raise
 
+def parse_meeting_time(file_name):
+    """Extract the meeting time from a Meet file name ("Title - date - time ..."), or None."""
+    match = _TIME_RE.match(file_name)
+    if match and match.group(1):
+        return match.group(1)
+    if " - " in file_name:
+        logging.warning(f"Could not parse meeting time from file name: {file_name}")
+    return None
+
+def file_meeting(drive_api, gemini_api, chat_api, validation_chat_api, file, file_name, meeting_type, analysis, content):
+    """Copy a summarized transcript into its category folder, mark it processed and queue its chat summary."""
+    destination_folder = drive_api.folder_mapping[meeting_type]
+    logging.info(f"Copying file {file_name} to folder: {meeting_type}")
+    if drive_api.copy_file(file['id'], destination_folder):
+        logging.info(f"Successfully copied file {file_name}")
+        drive_api.mark_all_with_title_as_processed(file_name)
+        logging.info(f"Successfully marked all files with title {file_name} as processed")
+        meeting_time = parse_meeting_time(file_name)
+        if meeting_type == "Daily Team Meeting":
+            if analysis and analysis.chat_summary:
+                chat_summary = analysis.chat_summary
+            else:
+                logging.info(f"Generating chat summary for daily meeting: {file_name}")
+                chat_summary = gemini_api.generate_chat_summary(content, meeting_time)
+            logging.info(f"Gemini chat summary for {file_name}: {repr(chat_summary)}")
+            if chat_summary:
+                logging.info(f"Sending chat summary for {file_name} to Google Chat")
+                chat_api.send_daily_meeting_summary([{'name': file_name, 'summary': chat_summary}])
+            else:
+                logging.error(f"Failed to generate chat summary for {file_name}")
+        elif meeting_type in ["User Research Meeting", "Product Development Meeting"]:
+            if analysis and analysis.validation_summary:
+                validation_summary = analysis.validation_summary
+            else:
+                logging.info(f"Generating user validation summary for meeting: {file_name}")
+                validation_summary = gemini_api.generate_user_validation_summary(content, meeting_time)
+            logging.info(f"Gemini user validation summary for {file_name}: {repr(validation_summary)}")
+            if validation_summary:
+                logging.info(f"Sending user validation summary for {file_name} to Google Chat")
+                validation_chat_api.send_daily_meeting_summary([{'name': file_name, 'summary': validation_summary}])
+            else:
+                logging.error(f"Failed to generate user validation summary for {file_name}")
+    else:
+        logging.error(f"Failed to copy file {file_name}")
+
+def process_file(drive_api, gemini_api, chat_api, validation_chat_api, file, today, processed_titles, claimed):
+    """Summarize one Meet transcript, returning the future of its background filing if one was started."""
+    try:
+        # Metadata comes with the Drive listing, no per-file lookup needed
+        mime_type = file.get('mimeType')
+        file_name = file.get('name', 'unknown')
+        if file.get('createdTime', '')[:10] != today:
+            logging.info(f"Skipping file {file_name} as it wasn't created today")
+            return None
+        # Overlapping requests (e.g. Drive notifications) may list the same file
+        if not drive_api.claim_file(file['id']):
+            logging.info(f"Skipping file {file_name} as it is already processed or in progress")
+            return None
+        claimed.append(file['id'])
+        if not processed_titles.claim(file_name):
+            logging.info(f"Skipping duplicate file title in this run: {file_name}")
+            return None
+        logging.info(f"Processing file: {file_name} (type: {mime_type})")
+        if mime_type == 'application/vnd.google-apps.document':
+            content = drive_api.export_document_text(file['id'])
+            if not content:
+                logging.warning(f"No content found in document: {file_name}")
+                return None
+            logging.info(f"Sending content to Gemini for file: {file_name}")
+            # One combined call when possible; fall back to separate calls otherwise
+            analysis = gemini_api.analyze_meeting(content, document_name=file_name)
+            if analysis:
+                meeting_type = analysis.meeting_type
+                doc_summary = analysis.doc_summary
+            else:
+                meeting_type = gemini_api.determine_meeting_type(content, document_name=file_name)
+                doc_summary = gemini_api.summarize_transcript(content)
+            logging.info(f"Determined meeting type: {meeting_type} for file: {file_name}")
+            logging.info(f"Gemini document summary for {file_name}: {repr(doc_summary)}")
+            if not doc_summary:
+                logging.warning(f"Gemini summary was empty for file: {file_name}. Skipping summary insertion.")
+                return None
+            summary_text = f"\n\n=== AI-Generated Summary ===\n{doc_summary}\n"
+            # Record the file before editing it: the edit is itself a Drive change, and the
+            # file must not be summarized again even if it is never copied or marked on Drive
+            drive_api.record_processed_locally(file['id'])
+            try:
+                drive_api.append_to_document(file['id'], summary_text)
+                logging.info(f"Successfully added summary to document: {file_name}")
+            except Exception as update_error:
+                logging.error(f"Failed to update document with summary for {file_name}: {str(update_error)}. Ensure the service account has editor rights.")
+                drive_api.forget_processed_locally(file['id'])
+                return None
+            if meeting_type in drive_api.folder_mapping:
+                # Filing and notifications overlap with the next file's Gemini calls
+                return _io_executor.submit(
+                    file_meeting, drive_api, gemini_api, chat_api, validation_chat_api,
+                    file, file_name, meeting_type, analysis, content
+                )
+            else:
+                logging.warning(f"Unknown meeting type '{meeting_type}' for file: {file_name}")
+        else:
+            logging.info(f"Skipping non-Google Doc file: {file_name}")
+    except Exception as e:
+        logging.error(f"Error processing file {file.get('name', 'unknown')}: {str(e)}")
+        return None
+
+def process_files(drive_api, gemini_api, chat_api, validation_chat_api, new_files, processed_titles):
+    """Categorize, summarize and file a list of Meet transcripts."""
+    logging.info(f"Found {len(new_files)} files to process")
+    # Drive reports createdTime in UTC, so compare against the UTC date
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    batch_size = 10
+    for i in range(0, len(new_files), batch_size):
+        batch = new_files[i:i + batch_size]
+        logging.info(f"Processing batch {i//batch_size + 1} of {(len(new_files) + batch_size - 1)//batch_size}")
+        claimed = []
+        # Files in a batch are analyzed concurrently; Gemini's rate limiter still paces the calls
+        futures = [
+            _file_executor.submit(
+                process_file, drive_api, gemini_api, chat_api, validation_chat_api,
+                file, today, processed_titles, claimed
+            )
+            for file in batch
+        ]
+        pending = [filing for filing in (future.result() for future in futures) if filing]
+        # No timeout: a filing may still queue its chat summary, which must happen before the flush
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Error filing processed file: {str(e)}")
+        for file_id in claimed:
+            drive_api.release_file(file_id)
+        logging.info(f"Completed processing batch {i//batch_size + 1}")
+
 @app.route('/', methods=['GET', 'POST'])
 def handle_request():
     """Handle incoming requests."""
     try:
         logging.info(f"Starting request handling - Method: {request.method}")
-        drive_api, gemini_api, chat_api, validation_chat_api = setup_apis()
+        drive_api, gemini_api, chat_api, validation_chat_api = get_apis()
         logging.info("APIs setup completed")
+        webhook_url = os.getenv('DRIVE_WEBHOOK_URL')
+        if webhook_url:
+            # Scheduled runs keep the push notification channel alive
+            drive_api.ensure_change_watch(webhook_url, token=os.getenv('DRIVE_WEBHOOK_TOKEN'))
         users = os.getenv('USERS_TO_PROCESS', '').strip().split(',')
         users = [user.strip() for user in users if user.strip()]
         logging.info(f"Users to process: {users}")
         results = []
-        processed_titles = set()  # Track processed file titles globally for this run
-        for user_email in users:
-            try:
-                logging.info(f"\n=== Starting processing for user: {user_email} ===")
-                process_meet_files(drive_api, gemini_api, chat_api, validation_chat_api, user_email, processed_titles)
-                results.append({"user": user_email, "status": "success"})
-                logging.info(f"=== Completed processing for user: {user_email} ===\n")
-            except Exception as e:
-                error_msg = f"Failed to process user {user_email}: {str(e)}"
-                logging.error(error_msg)
-                results.append({"user": user_email, "status": "error", "error": str(e)})
-                continue
+        processed_titles = new_processed_titles()  # Track processed file titles globally for this run
+        if users:
+            with ThreadPoolExecutor(max_workers=min(MAX_USER_WORKERS, len(users)), thread_name_prefix='user') as executor:
+                futures = {}
+                for user_email in users:
+                    logging.info(f"\n=== Starting processing for user: {user_email} ===")
+                    future = executor.submit(process_meet_files, drive_api, gemini_api, chat_api, validation_chat_api, user_email, processed_titles)
+                    futures[future] = user_email
+                for future in as_completed(futures):
+                    user_email = futures[future]
+                    try:
+                        future.result()
+                        results.append({"user": user_email, "status": "success"})
+                        logging.info(f"=== Completed processing for user: {user_email} ===\n")
+                    except Exception as e:
+                        error_msg = f"Failed to process user {user_email}: {str(e)}"
+                        logging.error(error_msg)
+                        results.append({"user": user_email, "status": "error", "error": str(e)})
+        # Send queued chat summaries before responding; CPU may be throttled afterwards
+        chat_api.flush()
+        validation_chat_api.flush()
         return jsonify({
             "status": "completed",
             "results": results,
@@ -220,6 +326,32 @@ def handle_request():
         logging.error(error_msg)
         return jsonify({"status": "error", "message": error_msg}), 500
 
+@app.route('/drive-notifications', methods=['POST'])
+def handle_drive_notification():
+    """Handle Drive push notifications by processing only the changed files."""
+    token = os.getenv('DRIVE_WEBHOOK_TOKEN')
+    if token and request.headers.get('X-Goog-Channel-Token') != token:
+        logging.warning("Rejected Drive notification with an invalid channel token")
+        return jsonify({"status": "error", "message": "Invalid channel token"}), 403
+    if request.headers.get('X-Goog-Resource-State') == 'sync':
+        logging.info(f"Drive change watch channel {request.headers.get('X-Goog-Channel-ID')} is active")
+        return jsonify({"status": "ok"}), 200
+    try:
+        drive_api, gemini_api, chat_api, validation_chat_api = get_apis()
+        changed_files = drive_api.get_changed_meet_files()
+        if changed_files:
+            process_files(drive_api, gemini_api, chat_api, validation_chat_api, changed_files, new_processed_titles())
+            chat_api.flush()
+            validation_chat_api.flush()
+        return jsonify({
+            "status": "completed",
+            "summary": f"Processed {len(changed_files)} changed files"
+        }), 200
+    except Exception as e:
+        error_msg = f"Fatal error in Drive notification handling: {str(e)}"
+        logging.error(error_msg)
+        return jsonify({"status": "error", "message": error_msg}), 500
+
 def escape_query_string(text):
     return text.replace("\\", "\\\\").replace("'", "\\'")
 